@@ -1,26 +1,94 @@
 #!/usr/bin/env python
 
-import re
+import os
+import mmap
 import argparse
 from pathlib import Path
 
+try:
+    import re2 as re  # google-re2，DFA 匹配，没有回溯
+except ImportError:  # 未安装 google-re2 时使用标准库
+    import re
+
+# 非标准时间轴行的匹配模式，在模块加载时编译一次；不使用环视，以兼容 RE2
+# 小时可省略（MM:SS.mmm），箭头两侧空白不限，其后可跟 cue 设置
+TIMESTAMP_RE = re.compile(
+    r"((?:\d+:)?\d{2}:\d{2}\.\d{3})[ \t]*-->[ \t]*"
+    r"((?:\d+:)?\d{2}:\d{2}\.\d{3})(?:[ \t]|$)"
+)
+# 文本块之间的空行分隔符：LF 与 CRLF 两种换行
+BLOCK_SEPARATORS = (b"\n\n", b"\n\r\n")
+
+
+def is_full_timestamp(timestamp):
+    """检查是否为标准的 HH:MM:SS.mmm 时间戳"""
+    return (
+        len(timestamp) == 12
+        and timestamp[2] == timestamp[5] == ":"
+        and timestamp[8] == "."
+        and timestamp[:2].isdecimal()
+        and timestamp[3:5].isdecimal()
+        and timestamp[6:8].isdecimal()
+        and timestamp[9:].isdecimal()
+    )
+
+
+def parse_timing(line):
+    """解析时间轴行，返回 (开始, 结束) 时间戳，不是时间轴行时返回 None"""
+    start, sep, end = line.partition(" --> ")
+    # 标准的 HH:MM:SS.mmm 格式直接按字符串切分，无需正则
+    end = end.partition(" ")[0]
+    if sep and is_full_timestamp(start) and is_full_timestamp(end):
+        return start, end
+    if match := TIMESTAMP_RE.match(line):
+        return match.groups()
+    return None
+
+
+def to_lrc_time(timestamp):
+    """将 VTT 时间戳转换为 LRC 的 mm:ss.xx 格式，小时折算为分钟"""
+    *hours, minutes, seconds = timestamp.split(":")
+    total_minutes = int(minutes) + (int(hours[0]) * 60 if hours else 0)
+    return f"{total_minutes:02d}:{seconds[:5]}"
+
+
+def decode_block(block):
+    """解码文本块，并去掉 CRLF 换行中的 CR"""
+    return block.decode("utf-8").replace("\r", "")
+
+
+def iter_blocks(vttfile):
+    """通过 mmap 逐个读取以空行分隔的文本块，避免一次性读入整个文件"""
+    with open(vttfile, "rb") as f:
+        # 空文件无法 mmap
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # 空行可能是 LF 或 CRLF 换行，分别记录下一个分隔符的位置，
+            # 只有越过后才重新查找，避免重复扫描
+            separators = {sep: mm.find(sep, 0) for sep in BLOCK_SEPARATORS}
+            pos = 0
+            while True:
+                found = [(i, sep) for sep, i in separators.items() if i != -1]
+                if not found:
+                    break
+                nxt, sep = min(found)
+                yield decode_block(mm[pos:nxt])
+                pos = nxt + len(sep)
+                for other, i in separators.items():
+                    if i != -1 and i < pos:
+                        separators[other] = mm.find(other, pos)
+            yield decode_block(mm[pos:])
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument("-s", default="*.vtt", help="search pattern")
-# args = parser.parse_args()
-# for vttFile in Path(".").glob(args.s):
-#    subtime = re.findall(r'\d*:\d*:\d*\.\d*(?= --\>)', vttFile.read_text())
-#    subword = vttFile.read_text().split('\n')[4:-1:4]
-#    with open(vttFile.with_suffix('.lrc'), 'w') as lrcFile:
-#        for (timeAxis, caption) in zip(subtime, subword):
-#            temp = timeAxis.split(':')
-#            subbed = temp[1] + ':' + temp[2][0:-1]
-#            lrcFile.write(f"[{subbed}]{caption}\n")
 
 if __name__ == "__main__":
     args = parser.parse_args()
     vttfiles = [i for i in Path().glob(args.s)]
     for vttfile in vttfiles:
-        cues = iter(vttfile.read_text().split("\n\n"))
+        cues = iter_blocks(vttfile)
         try:
             if not next(cues).startswith("WEBVTT"):
                 raise RuntimeError("错误的WEBVTT文件语法")
@@ -28,19 +96,20 @@ if __name__ == "__main__":
             print("空文件")
         except RuntimeError as e:
             print(e)
-        cuegroup = [i.split("\n") for i in cues if i != "\n"]
+        cuegroup = (i.split("\n") for i in cues if i != "\n")
+        # 先在内存中拼接所有歌词行，最后一次性写入
+        lrclines = []
         for cue in cuegroup:
             linar = iter(cue)
-            firstline = next(linar)
-            if re.fullmatch(r"\d*", firstline):
-                try:
-                    if re.fullmatch(
-                        r"\d*:\d*:\d*\.\d*(?= --\> )\d*:\d*:\d*\.\d*", next(linar)
-                    ):
-                        pass
-                except BaseException:
-                    exit()
-            elif re.fullmatch(r"\d*:\d*:\d*\.\d*(?= --\> )\d*:\d*:\d*\.\d*", firstline):
-                pass
-            for line in linar:
-                pass
+            timing = parse_timing(next(linar))
+            if timing is None:
+                # 首行为 cue 标识符，时间轴在下一行
+                timing = parse_timing(next(linar, ""))
+            if timing is None:
+                # 不是 cue 的块（如 NOTE、STYLE）或格式错误的 cue，跳过而不中止整个文件
+                continue
+            caption = " ".join(line for line in linar if line)
+            lrclines.append(f"[{to_lrc_time(timing[0])}]{caption}\n")
+        if lrclines:
+            with open(vttfile.with_suffix(".lrc"), "w", encoding="utf-8") as lrcfile:
+                lrcfile.write("".join(lrclines))
@@ -2,25 +2,51 @@
 
 import argparse
 import asyncio
+import contextlib
+import functools
 import json
+import os
+import signal
+import sqlite3
+import stat
+import subprocess
 import sys
+import tempfile
 import time
-import xml.etree.ElementTree as ET
+from concurrent.futures import Executor, ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple, Union
 from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+try:
+    import mutagen
+except ImportError:  # 未安装 mutagen 时全部交由 ffprobe 处理
+    mutagen = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # 未安装 orjson 时使用标准库解析
+    from json import loads as json_loads
 
 # 命名空间常量
 NS = "http://xspf.org/ns/0/"
-NS_PLAYLIST = f"{{{NS}}}playlist"
-NS_TRACKLIST = f"{{{NS}}}trackList"
-NS_TRACK = f"{{{NS}}}track"
-NS_LOCATION = f"{{{NS}}}location"
-NS_TITLE = f"{{{NS}}}title"
-NS_CREATOR = f"{{{NS}}}creator"
-NS_ALBUM = f"{{{NS}}}album"
-NS_TRACKNUM = f"{{{NS}}}trackNum"
-NS_DURATION = f"{{{NS}}}duration"
+
+# XML 声明，与 ElementTree 写入文件时的输出一致
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+# 属性值中需要额外转义的字符，与 ElementTree 保持一致
+ATTRIB_ENTITIES = {'"': "&quot;", "\r": "&#13;", "\n": "&#10;", "\t": "&#09;"}
+# 缩进输出时 trackList、track 及其子元素之前的空白
+TRACKLIST_INDENT = "\n  "
+TRACK_INDENT = "\n    "
+TRACK_FIELD_INDENT = "\n      "
+# 元数据键与 track 子元素标签的对应关系
+TRACK_FIELDS = (
+    ("title", "title"),
+    ("artist", "creator"),
+    ("album", "album"),
+    ("track", "trackNum"),
+)
 
 # 初始化参数解析
 parser = argparse.ArgumentParser(
@@ -53,18 +79,38 @@ parser.add_argument(
     "--concurrency",
     type=int,
     default=8,
-    help="Maximum concurrent tasks (default: 8)",
+    help="Number of metadata worker processes (default: 8)",
+)
+parser.add_argument(
+    "--cache",
+    type=Path,
+    default=Path.home() / ".cache" / "xspfgen.sqlite",
+    help="Metadata cache database (default: ~/.cache/xspfgen.sqlite)",
 )
 
 # 支持的媒体格式（不区分大小写）
 AUDIO_FORMATS = {".mp3", ".flac", ".ogg", ".m4a", ".ape", ".acc", ".wav"}
 VIDEO_FORMATS = {".mp4", ".avi", ".mkv", ".ts", ".mov"}
+# 可由 mutagen 直接读取标签的格式，其余格式回退到 ffprobe
+MUTAGEN_FORMATS = {".mp3", ".flac", ".ogg", ".m4a"}
 
 HIDE_CURSOR_CHARACTER = "\033[?25l"
 PRINT_CURSOR_CHARACTER = "\033[?25h"
 CLEAR_LINE_CHARACTER = "\033[K"
-
-
+# 获取单个文件元数据的超时时间（秒）
+METADATA_TIMEOUT = 10
+# 元数据缓存数据库被其他进程锁定时的最长等待时间（秒）
+CACHE_BUSY_TIMEOUT = 0.1
+# 进度条最短刷新间隔（秒），约 30 Hz
+PROGRESS_INTERVAL = 1 / 30
+# 进度条宽度及预先拼接的填充字符，按完成比例切片即可得到进度条
+PROGRESS_BAR_WIDTH = 20
+PROGRESS_BAR_CHARS = "#" * PROGRESS_BAR_WIDTH + "-" * PROGRESS_BAR_WIDTH
+# 进度条输出模板：完成数（按总数宽度右对齐）、总数、进度条、已用时间、剩余时间
+PROGRESS_TEMPLATE = "\r  %*d/%d [%s] %s < %s" + CLEAR_LINE_CHARACTER
+
+
+@functools.lru_cache(maxsize=None)
 def format_time(seconds: int) -> str:
     """格式化时间显示为 mm min ss s"""
     minutes, seconds = divmod(seconds, 60)
@@ -79,83 +125,311 @@ class AsyncProgressBar:
         self.completed = 0
         self.start_time = time.time()
         self.progress_width = len(str(total))
-        self.lock = asyncio.Lock()
         self._hidden_cursor = False
-
-    async def update(self) -> None:
-        """原子更新进度"""
-        async with self.lock:
-            self.completed += 1
-            if not self._hidden_cursor:
-                sys.stdout.write(HIDE_CURSOR_CHARACTER)
-                self._hidden_cursor = True
-            elapsed = int(time.time() - self.start_time)
-            progress = self.completed / self.total
-            filled = int(20 * progress)
-            bar = "#" * filled + "-" * (20 - filled)
-            remaining = int(elapsed / progress -
-                            elapsed) if progress > 0 else 0
-            sys.stdout.write(
-                f"\r  {self.completed:>{self.progress_width}}/{self.total} "
-                + f"[{bar}] {format_time(elapsed)} < {format_time(remaining)}"
-                + CLEAR_LINE_CHARACTER
+        self._last_render = 0.0
+
+    def update(self) -> None:
+        """更新进度，事件循环单线程执行，无需加锁"""
+        self.completed += 1
+        # 限制刷新频率，最后一次更新总是输出
+        now = time.monotonic()
+        if (
+            now - self._last_render < PROGRESS_INTERVAL
+            and self.completed < self.total
+        ):
+            return
+        self._last_render = now
+        if not self._hidden_cursor:
+            sys.stdout.write(HIDE_CURSOR_CHARACTER)
+            self._hidden_cursor = True
+        elapsed = int(time.time() - self.start_time)
+        progress = self.completed / self.total
+        filled = int(PROGRESS_BAR_WIDTH * progress)
+        start = PROGRESS_BAR_WIDTH - filled
+        bar = PROGRESS_BAR_CHARS[start:start + PROGRESS_BAR_WIDTH]
+        remaining = int(elapsed / progress -
+                        elapsed) if progress > 0 else 0
+        sys.stdout.write(
+            PROGRESS_TEMPLATE
+            % (
+                self.progress_width,
+                self.completed,
+                self.total,
+                bar,
+                format_time(elapsed),
+                format_time(remaining),
             )
-            sys.stdout.flush()
+        )
+        sys.stdout.flush()
 
-    async def cleanup(self) -> None:
+    def cleanup(self) -> None:
         """恢复终端状态"""
-        async with self.lock:
-            if self._hidden_cursor:
-                sys.stdout.write(PRINT_CURSOR_CHARACTER)
-                self._hidden_cursor = False
-
-
-async def async_get_metadata(
-    file_path: Path, sem: asyncio.Semaphore
-) -> Dict[str, Optional[str]]:
-    """异步获取媒体元数据"""
-    async with sem:
-        proc = await asyncio.create_subprocess_exec(
-            "ffprobe",
-            "-hide_banner",
-            "-v",
-            "quiet",
-            "-print_format",
-            "json",
-            "-show_entries",
-            "format_tags=title,artist,album,track",
-            "-show_entries",
-            "format=duration",
-            "-i",
-            str(file_path),
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        if self._hidden_cursor:
+            sys.stdout.write(PRINT_CURSOR_CHARACTER)
+            self._hidden_cursor = False
+
+
+# 通过 ffprobe 获取元数据的命令，媒体文件路径追加在末尾
+FFPROBE_COMMAND = (
+    "ffprobe",
+    "-hide_banner",
+    "-v",
+    "quiet",
+    "-threads",
+    "0",
+    "-print_format",
+    "json",
+    "-show_entries",
+    "format_tags=title,artist,album,track",
+    "-show_entries",
+    "format=duration",
+    "-i",
+)
+
+
+def parse_metadata(output: bytes) -> Dict[str, Optional[str]]:
+    """解析 ffprobe 的 JSON 输出"""
+    try:
+        data = json_loads(output)
+    except json.JSONDecodeError:
+        return {}
+
+    format_info = data.get("format", {})
+    tags = format_info.get("tags", {})
+    return {
+        "title": tags.get("title"),
+        "artist": tags.get("artist"),
+        "album": tags.get("album"),
+        "track": tags.get("track"),
+        "duration": format_info.get("duration", "0"),
+    }
+
+
+def ffprobe_metadata(file_path: Path) -> Dict[str, Optional[str]]:
+    """通过 ffprobe 子进程获取媒体元数据"""
+    try:
+        proc = subprocess.run(
+            [*FFPROBE_COMMAND, str(file_path)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=METADATA_TIMEOUT,
         )
+    except (OSError, subprocess.TimeoutExpired):
+        return {}
+
+    if proc.returncode != 0:
+        return {}
+    return parse_metadata(proc.stdout)
+
 
+def first_tag(tags: Any, key: str) -> Optional[str]:
+    """取 mutagen 标签的第一个值"""
+    values = tags.get(key)
+    return str(values[0]) if values else None
+
+
+def get_metadata(file_path: Path) -> Dict[str, Optional[str]]:
+    """获取媒体元数据，支持的格式直接用 mutagen 在进程内读取"""
+    if mutagen is None or file_path.suffix.lower() not in MUTAGEN_FORMATS:
+        return ffprobe_metadata(file_path)
+
+    try:
+        media = mutagen.File(file_path, easy=True)
+    except (mutagen.MutagenError, OSError):
+        media = None
+    if media is None:
+        return ffprobe_metadata(file_path)
+
+    tags = media.tags or {}
+    return {
+        "title": first_tag(tags, "title"),
+        "artist": first_tag(tags, "artist"),
+        "album": first_tag(tags, "album"),
+        "track": first_tag(tags, "tracknumber"),
+        "duration": str(media.info.length),
+    }
+
+
+def build_track(
+    location: str, metadata: Dict[str, Optional[str]], indent: bool
+) -> str:
+    """生成单个 track 元素的 XML 文本"""
+    # location 已经过 URL 编码，不含需要转义的字符
+    fields = [("location", location)]
+    if metadata:
+        for key, tag in TRACK_FIELDS:
+            if metadata.get(key):
+                fields.append((tag, escape(metadata[key])))
         try:
-            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=10)
-        except asyncio.TimeoutError:
-            proc.kill()
-            await proc.wait()
-            return {}
+            duration_ms = int(float(metadata["duration"]) * 1000)
+            fields.append(("duration", str(duration_ms)))
+        except (ValueError, KeyError):
+            pass
+
+    track_indent, field_indent = (
+        (TRACK_INDENT, TRACK_FIELD_INDENT) if indent else ("", "")
+    )
+    body = "".join(f"{field_indent}<{tag}>{text}</{tag}>" for tag, text in fields)
+    return f"{track_indent}<track>{body}{track_indent}</track>"
+
+
+class MetadataCache:
+    """以 (路径, 修改时间, 文件大小) 为键的 SQLite 元数据缓存"""
+
+    def __init__(self, db_path: Path) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 自动提交，写锁只在单条语句期间持有；等待锁的时间很短，避免阻塞事件循环
+        self.conn = sqlite3.connect(
+            db_path, timeout=CACHE_BUSY_TIMEOUT, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta "
+            "(path TEXT PRIMARY KEY, mtime INT, size INT, json BLOB)"
+        )
 
-        if proc.returncode != 0:
-            return {}
+    @staticmethod
+    def key(file_path: Path) -> Tuple[str, int, int]:
+        """生成缓存键，文件改动后键随之失效"""
+        st = file_path.stat()
+        return os.path.abspath(file_path), st.st_mtime_ns, st.st_size
+
+    def get(self, key: Tuple[str, int, int]) -> Optional[Dict[str, Optional[str]]]:
+        row = self.conn.execute(
+            "SELECT json FROM meta WHERE path = ? AND mtime = ? AND size = ?", key
+        ).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def put(
+        self, key: Tuple[str, int, int], metadata: Dict[str, Optional[str]]
+    ) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?)",
+            (*key, json.dumps(metadata)),
+        )
+
+    def close(self) -> None:
+        self.conn.close()
 
+
+def cache_get(
+    cache: MetadataCache, key: Tuple[str, int, int]
+) -> Optional[Dict[str, Optional[str]]]:
+    """读取缓存，数据库出错（被锁定、损坏等）时视为未命中"""
+    try:
+        return cache.get(key)
+    except sqlite3.Error:
+        return None
+
+
+def cache_put(
+    cache: MetadataCache,
+    key: Tuple[str, int, int],
+    metadata: Dict[str, Optional[str]],
+) -> None:
+    """写入缓存，数据库出错时放弃本次写入，不影响播放列表生成"""
+    with contextlib.suppress(sqlite3.Error):
+        cache.put(key, metadata)
+
+
+async def metadata_worker(
+    queue: asyncio.Queue,
+    executor: Optional[Executor],
+    cache: Optional[MetadataCache],
+) -> None:
+    """从队列中依次取出文件获取元数据，并回填到对应的 Future，遇到 None 时退出"""
+    loop = asyncio.get_running_loop()
+    while (job := await queue.get()) is not None:
+        file_path, result = job
         try:
-            data = json.loads(stdout)
-        except json.JSONDecodeError:
-            return {}
+            key = MetadataCache.key(file_path) if cache else None
+        except OSError:
+            key = None
+        try:
+            metadata = cache_get(cache, key) if key else None
+            if metadata is None:
+                try:
+                    metadata = await asyncio.wait_for(
+                        loop.run_in_executor(executor, get_metadata, file_path),
+                        timeout=METADATA_TIMEOUT,
+                    )
+                except asyncio.TimeoutError:
+                    # 读取卡住（如网络共享上的文件）时放弃该文件，避免阻塞后续写入
+                    metadata = {}
+                # 获取失败的结果不写入缓存，下次运行时重试
+                if key and metadata:
+                    cache_put(cache, key, metadata)
+        except Exception as e:
+            result.set_exception(e)
+        else:
+            result.set_result(metadata)
 
-        format_info = data.get("format", {})
-        tags = format_info.get("tags", {})
-        return {
-            "title": tags.get("title"),
-            "artist": tags.get("artist"),
-            "album": tags.get("album"),
-            "track": tags.get("track"),
-            "duration": format_info.get("duration", "0"),
-        }
+
+def iter_media(
+    root: Union[str, Path], suffixes: Tuple[str, ...]
+) -> Iterator[Path]:
+    """用 os.scandir 递归扫描目录，按 Path.walk 的顺序产出匹配后缀的文件"""
+    subdirs = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                # 与 Path.walk 一致：不跟随目录符号链接，无法访问的条目视为文件
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    subdirs.append(entry.path)
+                # 与 Path.suffix 一致：".mp3" 这类只有后缀的隐藏文件没有后缀
+                elif (
+                    entry.name.lower().endswith(suffixes)
+                    and entry.name.rfind(".") > 0
+                ):
+                    yield Path(entry.path)
+    except OSError:
+        return
+    for subdir in subdirs:
+        yield from iter_media(subdir, suffixes)
+
+
+@contextlib.contextmanager
+def atomic_output(output_file: Path) -> Iterator[TextIO]:
+    """写入同目录下的临时文件，完整写完后才替换目标文件，失败时删除临时文件"""
+    # 设备、管道等非普通文件（如 /dev/stdout）无法替换，直接写入
+    try:
+        is_regular = stat.S_ISREG(output_file.stat().st_mode)
+    except FileNotFoundError:
+        is_regular = True
+    if not is_regular:
+        with open(
+            output_file, "w", encoding="utf-8", errors="xmlcharrefreplace"
+        ) as f:
+            yield f
+        return
+
+    # 跟随符号链接，替换链接指向的真实文件
+    target = output_file.resolve()
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=target.parent, prefix=f".{target.name}.", suffix=".tmp"
+    )
+    try:
+        with open(fd, "w", encoding="utf-8", errors="xmlcharrefreplace") as f:
+            yield f
+        # mkstemp 创建的文件权限为 0600，改为与直接创建文件时相同的权限
+        try:
+            mode = target.stat().st_mode & 0o7777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, target)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
 
 
 async def generate_playlist(
@@ -166,83 +440,72 @@ async def generate_playlist(
     use_metadata: bool,
     playlist_name: Optional[str],
     path_prefix: str,
+    executor: Optional[Executor],
     concurrency: int,
+    cache: Optional[MetadataCache],
 ) -> None:
     """异步生成播放列表"""
-    ET.register_namespace("", NS)
-    # 创建XML根元素
-    attrib = {"version": "1"}
-    if playlist_name:
-        attrib["title"] = playlist_name
-    root = ET.Element(NS_PLAYLIST, attrib)
-    track_list = ET.SubElement(root, NS_TRACKLIST)
-
     # 收集媒体文件
-    media_files: List[Path] = [
-        (dir_path / filename)
-        for dir_path, _, filenames in root_path.walk()
-        for filename in filenames
-        if Path(filename).suffix.lower() in suffixes
-    ]
-
-    # 初始化进度条和信号量
+    media_files: List[Path] = list(iter_media(root_path, suffixes))
+
+    # 初始化进度条
+    loop = asyncio.get_running_loop()
     progress = AsyncProgressBar(
         len(media_files)) if sys.stdout.isatty() else None
-    sem = asyncio.Semaphore(concurrency)
-
-    # 异步获取元数据
-    metadata_tasks = []
-    for file_path in media_files:
-        if use_metadata:
-            task = asyncio.create_task(async_get_metadata(file_path, sem))
-            metadata_tasks.append(task)
-        else:
-            metadata_tasks.append(asyncio.sleep(0))  # 占位任务
-
-    # 处理结果并构建XML
-    for file_path, metadata_task in zip(media_files, metadata_tasks):
-        metadata = await metadata_task if use_metadata else {}
-        # 构建track元素
-        track = ET.SubElement(track_list, NS_TRACK)
-        location = quote(f"{path_prefix}{file_path.as_posix()}")
-        ET.SubElement(track, NS_LOCATION).text = location
-
-        if metadata:
-            if metadata.get("title"):
-                ET.SubElement(track, NS_TITLE).text = metadata["title"]
-            if metadata.get("artist"):
-                ET.SubElement(track, NS_CREATOR).text = metadata["artist"]
-            if metadata.get("album"):
-                ET.SubElement(track, NS_ALBUM).text = metadata["album"]
-            if metadata.get("track"):
-                ET.SubElement(track, NS_TRACKNUM).text = metadata["track"]
-            try:
-                duration_ms = int(float(metadata["duration"]) * 1000)
-                ET.SubElement(track, NS_DURATION).text = str(duration_ms)
-            except (ValueError, KeyError):
-                pass
-
-        # 更新进度条
-        if progress:
-            await progress.update()
-
-    # 格式化输出
-    if indent:
-        ET.indent(root)
-
-    # 写入文件或标准输出
-    if output_file:
-        ET.ElementTree(root).write(
-            output_file, encoding="utf-8", xml_declaration=True)
-        if progress:
-            elapsed = int(time.time() - progress.start_time)
-            sys.stdout.write(f"\nTotal time: {format_time(elapsed)}\n")
-    else:
-        ET.dump(root)
+
+    # 边获取元数据边写入文件或标准输出，文件输出先写入临时文件
+    with (
+        atomic_output(output_file)
+        if output_file
+        else contextlib.nullcontext(sys.stdout)
+    ) as out:
+        # 写入XML根元素
+        if output_file:
+            out.write(XML_DECLARATION)
+        out.write(f'<playlist xmlns="{NS}" version="1"')
+        if playlist_name:
+            out.write(f' title="{escape(playlist_name, ATTRIB_ENTITIES)}"')
+        out.write(f">{TRACKLIST_INDENT if indent else ''}<trackList>")
+
+        async with asyncio.TaskGroup() as workers:
+            # 由固定数量的工作协程从队列中取出文件，在进程池中获取元数据
+            metadata_tasks: List[asyncio.Future] = []
+            if use_metadata:
+                queue: asyncio.Queue = asyncio.Queue()
+                for file_path in media_files:
+                    result = loop.create_future()
+                    metadata_tasks.append(result)
+                    queue.put_nowait((file_path, result))
+                for _ in range(concurrency):
+                    queue.put_nowait(None)
+                    workers.create_task(metadata_worker(queue, executor, cache))
+
+            # 按列表顺序写入已就绪的track，后续文件的元数据仍在后台获取
+            for i, file_path in enumerate(media_files):
+                # 未请求元数据时不创建任何任务，直接写入location
+                metadata = await metadata_tasks[i] if use_metadata else {}
+                location = quote(f"{path_prefix}{file_path.as_posix()}")
+                out.write(build_track(location, metadata, indent))
+
+                # 更新进度条
+                if progress:
+                    progress.update()
+
+        out.write(
+            f"{TRACKLIST_INDENT}</trackList>\n</playlist>"
+            if indent
+            else "</trackList></playlist>"
+        )
+        if not output_file:
+            out.write("\n")
+
+    if output_file and progress:
+        elapsed = int(time.time() - progress.start_time)
+        sys.stdout.write(f"\nTotal time: {format_time(elapsed)}\n")
 
     # 清理终端状态
     if progress:
-        await progress.cleanup()
+        progress.cleanup()
 
 
 async def main() -> None:
@@ -261,6 +524,22 @@ async def main() -> None:
         )
         sys.exit(1)
 
+    # 进程池在整个运行期间复用，子进程忽略 SIGINT，由主进程统一处理中断
+    executor = (
+        ProcessPoolExecutor(
+            args.concurrency,
+            initializer=signal.signal,
+            initargs=(signal.SIGINT, signal.SIG_IGN),
+        )
+        if args.metadata
+        else None
+    )
+    cache = None
+    if args.metadata:
+        try:
+            cache = MetadataCache(args.cache)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: metadata cache disabled: {e}", file=sys.stderr)
     try:
         await generate_playlist(
             root_path=args.path,
@@ -270,11 +549,18 @@ async def main() -> None:
             use_metadata=args.metadata,
             playlist_name=args.name,
             path_prefix=args.prefix,
+            executor=executor,
             concurrency=args.concurrency,
+            cache=cache,
         )
     except asyncio.CancelledError:
         if sys.stdout.isatty():
             sys.stdout.write(PRINT_CURSOR_CHARACTER)  # 确保恢复光标
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        if cache:
+            cache.close()
 
 
 if __name__ == "__main__":